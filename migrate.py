@@ -12,9 +12,10 @@ from pathlib import Path
 # Add the src directory to the path
 sys.path.append(str(Path(__file__).parent / "src"))
 
-from src.database import init_database, seed_initial_data, AsyncSessionLocal, create_backup
+from src.database import init_database, seed_initial_data, AsyncSessionLocal, create_backup, engine
 from src.models import Activity, User, Base
-from sqlalchemy import select, text
+from datetime import datetime
+from sqlalchemy import select, text, func, update
 
 
 async def migrate_database():
@@ -35,26 +36,28 @@ async def migrate_database():
         # Check if we need to migrate data
         async with AsyncSessionLocal() as session:
             # Test if the database has data
-            result = await session.execute(select(Activity))
-            activities = result.scalars().all()
+            activity_count = await session.scalar(
+                select(func.count()).select_from(Activity)
+            )
             
-            if not activities:
+            if not activity_count:
                 print("📥 No existing data found, seeding initial data...")
                 await seed_initial_data()
             else:
-                print(f"✅ Found {len(activities)} existing activities")
+                print(f"✅ Found {activity_count} existing activities")
                 
                 # You can add specific migration logic here
                 # For example, add new columns or update data formats
                 
-                # Example: Update any activities without created_at timestamps
-                activities_without_timestamps = [a for a in activities if a.created_at is None]
-                if activities_without_timestamps:
-                    from datetime import datetime
-                    print(f"🔧 Updating {len(activities_without_timestamps)} activities with missing timestamps...")
-                    for activity in activities_without_timestamps:
-                        activity.created_at = datetime.utcnow()
-                    await session.commit()
+                # Example: Backfill missing created_at timestamps in one statement
+                result = await session.execute(
+                    update(Activity)
+                    .where(Activity.created_at.is_(None))
+                    .values(created_at=datetime.utcnow())
+                )
+                if result.rowcount:
+                    print(f"🔧 Updated {result.rowcount} activities with missing timestamps")
+                await session.commit()
         
         print("🎉 Database migration completed successfully!")
         return True
@@ -80,7 +83,6 @@ async def reset_database():
             print(f"📦 Backup created: {backup_path}")
         
         # Drop and recreate all tables
-        from src.database import engine
         async with engine.begin() as conn:
             await conn.run_sync(Base.metadata.drop_all)
             await conn.run_sync(Base.metadata.create_all)
@@ -100,32 +102,29 @@ async def check_database_health():
     """Check database health and show statistics"""
     try:
         async with AsyncSessionLocal() as session:
-            from sqlalchemy.orm import selectinload
-            
-            # Count activities
+            # Count participants per activity in the database
             result = await session.execute(
-                select(Activity).options(selectinload(Activity.participants))
+                select(Activity.name, Activity.max_participants, Activity.participant_count)
             )
-            activities = result.scalars().all()
+            activities = result.all()
             
             # Count users
-            result = await session.execute(select(User))
-            users = result.scalars().all()
+            user_count = await session.scalar(select(func.count()).select_from(User))
             
             # Calculate total enrollments
-            total_enrollments = sum(len(activity.participants) for activity in activities)
+            total_enrollments = sum(activity.participant_count for activity in activities)
             
             print("📊 Database Health Report:")
             print(f"   Activities: {len(activities)}")
-            print(f"   Users: {len(users)}")
+            print(f"   Users: {user_count}")
             print(f"   Total Enrollments: {total_enrollments}")
             
             # Show activity details
             print("\n📋 Activity Details:")
             for activity in activities:
-                spots_left = activity.max_participants - len(activity.participants)
+                spots_left = activity.max_participants - activity.participant_count
                 status = "FULL" if spots_left == 0 else f"{spots_left} spots left"
-                print(f"   • {activity.name}: {len(activity.participants)}/{activity.max_participants} ({status})")
+                print(f"   • {activity.name}: {activity.participant_count}/{activity.max_participants} ({status})")
         
         return True
         
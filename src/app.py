@@ -6,17 +6,25 @@ for extracurricular activities at Mergington High School.
 Now with persistent database storage and improved error handling!
 """
 
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Request, Response, status
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import RedirectResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy import JSON, Integer, select, func, text, bindparam, type_coerce
+from sqlalchemy.orm import undefer
+from sqlalchemy.exc import SQLAlchemyError
 import os
+import orjson
+import time
+import asyncio
+import hashlib
 import logging
 from pathlib import Path
-from .database import get_db, init_database, seed_initial_data, create_backup
-from .models import Activity, User, activity_participants
+from .database import (
+    DEBUG, IS_POSTGRESQL, engine, get_db, init_database, seed_initial_data, create_backup, count_queries,
+    dialect_insert
+)
+from .models import Activity, User, activity_participants, normalize_email
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -28,12 +36,132 @@ app = FastAPI(
     version="2.0.0"
 )
 
+# Seconds before /health reports the database as unavailable
+HEALTH_CHECK_TIMEOUT = 2.0
+
+# Requests issuing more statements than this are logged in debug mode
+QUERY_COUNT_WARNING_THRESHOLD = 3
+
+# Participant emails aggregated into a real array per activity (never a
+# delimited string, since emails may contain any separator character)
+if IS_POSTGRESQL:
+    _participant_emails = func.array_agg(User.email).filter(User.email.is_not(None))
+else:
+    _participant_emails = type_coerce(
+        func.json_group_array(User.email).filter(User.email.is_not(None)), JSON
+    )
+
+# Statements used by the endpoints, built once so each request only binds
+# parameters and hits the engine's compiled-statement cache
+_Q_ACTIVITIES_SUMMARY = (
+    select(
+        Activity.name,
+        Activity.description,
+        Activity.schedule,
+        Activity.max_participants,
+        _participant_emails.label("emails"),
+        func.count(User.id).label("participant_count"),
+    )
+    .select_from(Activity)
+    .outerjoin(activity_participants)
+    .outerjoin(User)
+    .group_by(Activity.id)
+)
+_Q_ACTIVITY_BY_NAME = select(Activity).where(Activity.name == bindparam("name"))
+# FOR UPDATE (PostgreSQL only) serializes signups per activity so the
+# capacity check in _Q_INSERT_ENROLLMENT sees every committed enrollment
+_Q_ACTIVITY_WITH_COUNT_BY_NAME = (
+    _Q_ACTIVITY_BY_NAME
+    .options(undefer(Activity.participant_count))
+    .with_for_update(of=Activity)
+)
+_Q_USER_ID_BY_EMAIL = select(User.id).where(User.email == bindparam("email"))
+# Inserts that no-op on conflict and return a row only when one was created
+_Q_INSERT_USER = (
+    dialect_insert(User)
+    .on_conflict_do_nothing(index_elements=[User.email])
+    .returning(User.id)
+)
+# Enrolls only while the activity has a free spot, checked in the same
+# statement as the insert
+_Q_INSERT_ENROLLMENT = (
+    dialect_insert(activity_participants)
+    .from_select(
+        ["activity_id", "user_id"],
+        select(
+            bindparam("activity_id", type_=Integer),
+            bindparam("user_id", type_=Integer)
+        ).where(
+            select(func.count())
+            .select_from(activity_participants)
+            .where(activity_participants.c.activity_id == bindparam("activity_id"))
+            .scalar_subquery()
+            < select(Activity.max_participants)
+            .where(Activity.id == bindparam("activity_id"))
+            .scalar_subquery()
+        )
+    )
+    .on_conflict_do_nothing()
+    .returning(activity_participants.c.user_id)
+)
+_Q_ENROLLMENT_EXISTS = (
+    select(activity_participants.c.user_id)
+    .where(
+        activity_participants.c.activity_id == bindparam("activity_id"),
+        activity_participants.c.user_id == bindparam("user_id")
+    )
+    .limit(1)
+)
+_Q_DELETE_ENROLLMENT = activity_participants.delete().where(
+    activity_participants.c.activity_id == bindparam("activity_id"),
+    activity_participants.c.user_id == bindparam("user_id")
+)
+
+# Process-local cache of the serialized /activities response. It is
+# invalidated by signups/unregisters handled in this process only, so it
+# assumes a single worker; the TTL bounds how stale it can get when writes
+# come from other workers or from scripts such as migrate.py
+ACTIVITIES_CACHE_TTL = float(os.getenv("ACTIVITIES_CACHE_TTL", "5"))
+_activities_cache = {"version": 0, "payload": None, "etag": None, "expires_at": 0.0}
+
+
+def _invalidate_activities_cache():
+    """Drop the cached /activities response after a mutation"""
+    _activities_cache["version"] += 1
+    _activities_cache["payload"] = None
+    _activities_cache["etag"] = None
+
+
+def _validated_email(email):
+    """Normalize an email query parameter or reject it with a 400"""
+    try:
+        return normalize_email(email)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid email format"
+        )
+
+
 # Mount the static files directory
 current_dir = Path(__file__).parent
 app.mount("/static", StaticFiles(directory=os.path.join(Path(__file__).parent,
           "static")), name="static")
 
 
+if DEBUG:
+    @app.middleware("http")
+    async def log_query_count(request: Request, call_next):
+        """Log requests that issue an unexpectedly high number of SQL statements"""
+        with count_queries() as counter:
+            response = await call_next(request)
+        if counter[0] > QUERY_COUNT_WARNING_THRESHOLD:
+            logger.warning(
+                f"{request.method} {request.url.path} issued {counter[0]} SQL queries"
+            )
+        return response
+
+
 @app.on_event("startup")
 async def startup_event():
     """Initialize database on startup"""
@@ -53,28 +181,51 @@ def root():
 
 
 @app.get("/activities")
-async def get_activities(db: AsyncSession = Depends(get_db)):
+async def get_activities(request: Request, db: AsyncSession = Depends(get_db)):
     """Get all activities with their participants"""
-    try:
-        from sqlalchemy.orm import selectinload
-        result = await db.execute(
-            select(Activity).options(selectinload(Activity.participants))
+    if (
+        _activities_cache["payload"] is not None
+        and time.monotonic() < _activities_cache["expires_at"]
+    ):
+        etag = _activities_cache["etag"]
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+        return Response(
+            content=_activities_cache["payload"],
+            media_type="application/json",
+            headers={"ETag": etag}
         )
-        activities = result.scalars().all()
+    
+    try:
+        version = _activities_cache["version"]
+        # Aggregate participants in the database instead of loading ORM objects
+        result = await db.execute(_Q_ACTIVITIES_SUMMARY)
         
         # Convert to the format expected by the frontend
         activities_dict = {}
-        for activity in activities:
-            activities_dict[activity.name] = {
-                "description": activity.description,
-                "schedule": activity.schedule,
-                "max_participants": activity.max_participants,
-                "participants": [user.email for user in activity.participants],
-                "available_spots": activity.available_spots,
-                "is_full": activity.is_full
+        for row in result.mappings():
+            participant_count = row["participant_count"]
+            activities_dict[row["name"]] = {
+                "description": row["description"],
+                "schedule": row["schedule"],
+                "max_participants": row["max_participants"],
+                "participants": row["emails"] or [],
+                "available_spots": row["max_participants"] - participant_count,
+                "is_full": participant_count >= row["max_participants"]
             }
         
-        return activities_dict
+        payload = orjson.dumps(activities_dict)
+        etag = f'"{hashlib.blake2b(payload, digest_size=8).hexdigest()}"'
+        
+        # Only cache if no mutation happened while we were querying
+        if _activities_cache["version"] == version:
+            _activities_cache["payload"] = payload
+            _activities_cache["etag"] = etag
+            _activities_cache["expires_at"] = time.monotonic() + ACTIVITIES_CACHE_TTL
+        
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+        return Response(content=payload, media_type="application/json", headers={"ETag": etag})
     except SQLAlchemyError as e:
         logger.error(f"Database error in get_activities: {e}")
         raise HTTPException(
@@ -86,13 +237,11 @@ async def get_activities(db: AsyncSession = Depends(get_db)):
 @app.post("/activities/{activity_name}/signup")
 async def signup_for_activity(activity_name: str, email: str, db: AsyncSession = Depends(get_db)):
     """Sign up a student for an activity"""
+    email = _validated_email(email)
     try:
-        from sqlalchemy.orm import selectinload
-        # Get the activity with participants loaded
+        # Get the activity along with its SQL-computed participant count
         result = await db.execute(
-            select(Activity)
-            .options(selectinload(Activity.participants))
-            .where(Activity.name == activity_name)
+            _Q_ACTIVITY_WITH_COUNT_BY_NAME, {"name": activity_name}
         )
         activity = result.scalar_one_or_none()
         
@@ -100,31 +249,34 @@ async def signup_for_activity(activity_name: str, email: str, db: AsyncSession =
             raise HTTPException(status_code=404, detail="Activity not found")
         
         # Check if activity is full before proceeding
-        if activity.is_full:
+        if activity.participant_count >= activity.max_participants:
             raise HTTPException(
                 status_code=400,
                 detail="Activity is full"
             )
         
-        # Get or create the user
-        result = await db.execute(select(User).where(User.email == email))
-        user = result.scalar_one_or_none()
-        
-        if not user:
-            user = User(email=email)
-            db.add(user)
-            await db.flush()  # Get the user ID
+        # Get or create the user; the unique email index settles concurrent signups
+        user_id = await db.scalar(_Q_INSERT_USER, {"email": email})
+        if user_id is None:
+            user_id = await db.scalar(_Q_USER_ID_BY_EMAIL, {"email": email})
         
-        # Check if user is already signed up
-        if user in activity.participants:
+        # Add user to activity; nothing is returned if they were already
+        # enrolled or the last spot was taken by a concurrent signup
+        params = {"activity_id": activity.id, "user_id": user_id}
+        result = await db.execute(_Q_INSERT_ENROLLMENT, params)
+        if result.first() is None:
+            if await db.scalar(_Q_ENROLLMENT_EXISTS, params) is not None:
+                raise HTTPException(
+                    status_code=400,
+                    detail="Student is already signed up"
+                )
             raise HTTPException(
                 status_code=400,
-                detail="Student is already signed up"
+                detail="Activity is full"
             )
         
-        # Add user to activity
-        activity.participants.append(user)
         await db.commit()
+        _invalidate_activities_cache()
         
         logger.info(f"User {email} signed up for {activity_name}")
         return {"message": f"Signed up {email} for {activity_name}"}
@@ -132,13 +284,6 @@ async def signup_for_activity(activity_name: str, email: str, db: AsyncSession =
     except HTTPException:
         # Re-raise HTTP exceptions as-is
         raise
-    except IntegrityError as e:
-        await db.rollback()
-        logger.error(f"Integrity error in signup: {e}")
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Data integrity error - possibly invalid email format"
-        )
     except SQLAlchemyError as e:
         await db.rollback()
         logger.error(f"Database error in signup: {e}")
@@ -151,32 +296,34 @@ async def signup_for_activity(activity_name: str, email: str, db: AsyncSession =
 @app.delete("/activities/{activity_name}/unregister")
 async def unregister_from_activity(activity_name: str, email: str, db: AsyncSession = Depends(get_db)):
     """Unregister a student from an activity"""
+    email = _validated_email(email)
     try:
-        from sqlalchemy.orm import selectinload
-        # Get the activity with participants loaded
-        result = await db.execute(
-            select(Activity)
-            .options(selectinload(Activity.participants))
-            .where(Activity.name == activity_name)
-        )
+        # Get the activity
+        result = await db.execute(_Q_ACTIVITY_BY_NAME, {"name": activity_name})
         activity = result.scalar_one_or_none()
         
         if not activity:
             raise HTTPException(status_code=404, detail="Activity not found")
         
         # Get the user
-        result = await db.execute(select(User).where(User.email == email))
-        user = result.scalar_one_or_none()
+        user_id = await db.scalar(_Q_USER_ID_BY_EMAIL, {"email": email})
         
-        if not user or user not in activity.participants:
+        # Remove user from activity
+        removed = None
+        if user_id is not None:
+            result = await db.execute(
+                _Q_DELETE_ENROLLMENT, {"activity_id": activity.id, "user_id": user_id}
+            )
+            removed = result.rowcount
+        
+        if not removed:
             raise HTTPException(
                 status_code=400,
                 detail="Student is not signed up for this activity"
             )
         
-        # Remove user from activity
-        activity.participants.remove(user)
         await db.commit()
+        _invalidate_activities_cache()
         
         logger.info(f"User {email} unregistered from {activity_name}")
         return {"message": f"Unregistered {email} from {activity_name}"}
@@ -211,16 +358,23 @@ async def create_database_backup():
 
 
 @app.get("/health")
-async def health_check(db: AsyncSession = Depends(get_db)):
+async def health_check():
     """Health check endpoint to verify database connectivity"""
     try:
-        # Simple query to test database connection
-        result = await db.execute(select(Activity).limit(1))
-        result.scalar_one_or_none()
+        # Bypass the session dependency so an exhausted pool fails fast
+        await asyncio.wait_for(_ping_database(), timeout=HEALTH_CHECK_TIMEOUT)
         return {"status": "healthy", "database": "connected"}
     except Exception as e:
-        logger.error(f"Health check failed: {e}")
+        logger.error(f"Health check failed: {e!r}")
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail="Database connection failed"
         )
+
+
+async def _ping_database():
+    """Run a trivial query on a pooled connection"""
+    async with engine.connect() as conn:
+        result = await conn.execute(text("SELECT 1"))
+        if result.scalar() != 1:
+            raise RuntimeError("Unexpected result from SELECT 1")
@@ -3,15 +3,20 @@ Database configuration and setup for the Mergington High School activities syste
 """
 
 import os
+import asyncio
+import contextvars
 import logging
-import shutil
+import sqlite3
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.pool import StaticPool
-from .models import Base
+from sqlalchemy import event, select, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, StaticPool
+from .models import Base, Activity, User, activity_participants
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -19,15 +24,23 @@ logger = logging.getLogger(__name__)
 # Database URL - use SQLite for development, can be changed for production
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./mergington_activities.db")
 
+# Backend/driver checks shared by everything that behaves per database
+_database_url = make_url(DATABASE_URL)
+IS_SQLITE = _database_url.get_backend_name() == "sqlite"
+IS_POSTGRESQL = _database_url.get_backend_name() == "postgresql"
+USE_ASYNCPG_COPY = IS_POSTGRESQL and _database_url.get_driver_name() == "asyncpg"
+
+DEBUG = os.getenv("DEBUG", "false").lower() == "true"
+
 # Database configuration with connection pooling
 engine_kwargs = {
-    "echo": os.getenv("DEBUG", "false").lower() == "true",  # Only echo in debug mode
+    "echo": DEBUG,  # Only echo in debug mode
+    "query_cache_size": 1200,  # Compiled-statement cache entries
 }
 
 # For SQLite, add connection pooling and WAL mode for better concurrency
-if "sqlite" in DATABASE_URL:
+if IS_SQLITE:
     engine_kwargs.update({
-        "poolclass": StaticPool,
         "connect_args": {
             "check_same_thread": False,
             "timeout": 20,
@@ -35,21 +48,95 @@ if "sqlite" in DATABASE_URL:
         "pool_pre_ping": True,
         "pool_recycle": 300,
     })
+    if ":memory:" in DATABASE_URL:
+        # Every connection to :memory: is a separate database, so share one
+        engine_kwargs["poolclass"] = StaticPool
+    else:
+        engine_kwargs.update({
+            "poolclass": AsyncAdaptedQueuePool,
+            "pool_size": 5,
+            "max_overflow": 10,
+        })
+elif IS_POSTGRESQL:
+    engine_kwargs.update({
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "20")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "0")),
+        "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT", "30")),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "3600")),
+        "pool_pre_ping": True,
+    })
 
 # Create async engine with improved configuration
 engine = create_async_engine(DATABASE_URL, **engine_kwargs)
 
+# Apply SQLite PRAGMAs once per physical connection
+if IS_SQLITE:
+    @event.listens_for(engine.sync_engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        """Enable WAL and related PRAGMAs on every new SQLite connection"""
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA cache_size=-65536")  # 64 MiB
+        cursor.execute("PRAGMA mmap_size=268435456")
+        cursor.close()
+
+
+# Serializes seeding within this process. Across worker processes,
+# PostgreSQL seeding takes a transaction-scoped advisory lock (COPY does not
+# skip conflicts); on SQLite the ON CONFLICT DO NOTHING inserts make a
+# concurrent second seed a no-op.
+_seed_lock = asyncio.Lock()
+_SEED_ADVISORY_LOCK_ID = 0x4D48535F53454544  # "MHS_SEED"
+
+# Per-request SQL statement counter, only populated inside count_queries()
+_query_counter = contextvars.ContextVar("query_counter", default=None)
+
+# Query counting is a development aid, so production pays nothing for it
+if DEBUG:
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def _count_query(conn, cursor, statement, parameters, context, executemany):
+        """Increment the active query counter, if any"""
+        counter = _query_counter.get()
+        if counter is not None:
+            counter[0] += 1
+
+
+@contextmanager
+def count_queries():
+    """
+    Count SQL statements executed in this context; yields a one-item list.
+    
+    Statements are only counted when DEBUG is enabled.
+    """
+    counter = [0]
+    token = _query_counter.set(counter)
+    try:
+        yield counter
+    finally:
+        _query_counter.reset(token)
+
+
 # Create async session factory
-AsyncSessionLocal = sessionmaker(
-    engine, class_=AsyncSession, expire_on_commit=False
+AsyncSessionLocal = async_sessionmaker(
+    engine, expire_on_commit=False, autoflush=False
 )
 
 
+def _create_missing_indexes(connection):
+    """Create indexes added to models after their tables already existed"""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
 async def init_database():
     """Initialize the database and create tables"""
     try:
         async with engine.begin() as conn:
             await conn.run_sync(Base.metadata.create_all)
+            await conn.run_sync(_create_missing_indexes)
         logger.info("Database initialized successfully")
     except Exception as e:
         logger.error(f"Failed to initialize database: {e}")
@@ -58,24 +145,32 @@ async def init_database():
 
 async def get_db():
     """Dependency to get database session with proper error handling"""
-    session = None
-    try:
-        session = AsyncSessionLocal()
-        yield session
-    except Exception as e:
-        if session:
+    async with AsyncSessionLocal() as session:
+        try:
+            yield session
+        except Exception as e:
             await session.rollback()
-        logger.error(f"Database session error: {e}")
-        raise
+            logger.error(f"Database session error: {e}")
+            raise
+
+
+def _do_backup(db_path, backup_path):
+    """Copy a live SQLite database using the online backup API"""
+    source = sqlite3.connect(db_path)
+    try:
+        destination = sqlite3.connect(backup_path)
+        try:
+            source.backup(destination, pages=1000)
+        finally:
+            destination.close()
     finally:
-        if session:
-            await session.close()
+        source.close()
 
 
 async def create_backup():
     """Create a backup of the SQLite database"""
     try:
-        if "sqlite" in DATABASE_URL:
+        if IS_SQLITE:
             # Extract database path from URL
             db_path = DATABASE_URL.split("///")[-1]
             if db_path.startswith("./"):
@@ -87,7 +182,8 @@ async def create_backup():
                 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
                 backup_path = db_file.parent / f"{db_file.stem}_backup_{timestamp}{db_file.suffix}"
                 
-                shutil.copy2(db_file, backup_path)
+                # Run off the event loop; the backup API gives a consistent snapshot
+                await asyncio.to_thread(_do_backup, str(db_file), str(backup_path))
                 logger.info(f"Database backup created: {backup_path}")
                 return str(backup_path)
             else:
@@ -101,17 +197,71 @@ async def create_backup():
         raise
 
 
+def dialect_insert(table):
+    """Dialect-specific INSERT construct supporting ON CONFLICT DO NOTHING"""
+    if IS_POSTGRESQL:
+        return postgresql_insert(table)
+    return sqlite_insert(table)
+
+
+async def bulk_copy(session, table_name, rows, columns):
+    """Load rows into a PostgreSQL table using asyncpg's native COPY protocol"""
+    conn = await session.connection()
+    raw = await conn.get_raw_connection()
+    await raw.driver_connection.copy_records_to_table(
+        table_name, records=rows, columns=columns
+    )
+
+
+async def bulk_insert(session, table, rows):
+    """
+    Insert many rows at once, using COPY on PostgreSQL via asyncpg and a
+    batched INSERT ... ON CONFLICT DO NOTHING elsewhere.
+    
+    COPY does not skip conflicting rows, so with asyncpg the target
+    table must not already contain them.
+    """
+    if not rows:
+        return
+    
+    table = getattr(table, "__table__", table)
+    if not USE_ASYNCPG_COPY:
+        await session.execute(dialect_insert(table).on_conflict_do_nothing(), rows)
+        return
+    
+    # COPY bypasses SQLAlchemy, so fill in Python-side column defaults here
+    columns = list(rows[0])
+    defaults = {}
+    for column in table.columns:
+        default = column.default
+        if column.name in columns or default is None:
+            continue
+        if default.is_scalar:
+            defaults[column.name] = default.arg
+        elif default.is_callable:
+            defaults[column.name] = default.arg(None)
+    columns.extend(defaults)
+    
+    records = [
+        tuple(row[name] if name in row else defaults[name] for name in columns)
+        for row in rows
+    ]
+    await bulk_copy(session, table.name, records, columns)
+
+
 async def seed_initial_data():
     """Seed the database with initial activities data"""
-    from .models import Activity, User, activity_participants
-    from sqlalchemy import select
-    
-    async with AsyncSessionLocal() as session:
-        # Check if we already have data
-        result = await session.execute(select(Activity))
-        existing_activities = result.scalars().all()
+    async with _seed_lock, AsyncSessionLocal() as session:
+        if IS_POSTGRESQL:
+            # Held until commit, so other workers wait and then see the data
+            await session.execute(
+                text("SELECT pg_advisory_xact_lock(:lock_id)"),
+                {"lock_id": _SEED_ADVISORY_LOCK_ID}
+            )
         
-        if existing_activities:
+        # Check if we already have data without loading any rows
+        result = await session.execute(select(1).select_from(Activity).limit(1))
+        if result.first() is not None:
             return  # Data already exists
         
         # Create initial activities
@@ -172,10 +322,8 @@ async def seed_initial_data():
             }
         ]
         
-        # Create activities
-        for activity_data in initial_activities:
-            activity = Activity(**activity_data)
-            session.add(activity)
+        # Create all activities in one bulk INSERT
+        await bulk_insert(session, Activity, initial_activities)
         
         # Create some initial users with existing enrollments
         initial_users_data = [
@@ -199,34 +347,24 @@ async def seed_initial_data():
             ("henry@mergington.edu", "Debate Team")
         ]
         
-        await session.commit()
+        # Create all users in one bulk INSERT (duplicates are skipped)
+        emails = list(dict.fromkeys(email for email, _ in initial_users_data))
+        await bulk_insert(session, User, [{"email": email} for email in emails])
         
-        # Now add users and their enrollments
-        for email, activity_name in initial_users_data:
-            # Get or create user
-            result = await session.execute(select(User).where(User.email == email))
-            user = result.scalar_one_or_none()
-            
-            if not user:
-                user = User(email=email)
-                session.add(user)
-                await session.flush()  # Get the user ID
-            
-            # Get activity
-            result = await session.execute(select(Activity).where(Activity.name == activity_name))
-            activity = result.scalar_one_or_none()
-            
-            if activity:
-                # Check if user is already enrolled (avoid duplicates)
-                result = await session.execute(
-                    select(User).join(activity_participants).join(Activity).where(
-                        User.id == user.id,
-                        Activity.id == activity.id
-                    )
-                )
-                existing_enrollment = result.scalar_one_or_none()
-                
-                if not existing_enrollment:
-                    activity.participants.append(user)
+        # Resolve generated IDs with one query per table
+        result = await session.execute(select(Activity.name, Activity.id))
+        activity_ids = dict(result.all())
+        result = await session.execute(
+            select(User.email, User.id).where(User.email.in_(emails))
+        )
+        user_ids = dict(result.all())
+        
+        # Create all enrollments in one bulk INSERT
+        enrollments = [
+            {"activity_id": activity_ids[activity_name], "user_id": user_ids[email]}
+            for email, activity_name in initial_users_data
+            if activity_name in activity_ids
+        ]
+        await bulk_insert(session, activity_participants, enrollments)
         
         await session.commit()
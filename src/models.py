@@ -2,14 +2,27 @@
 Database models for the Mergington High School activities system.
 """
 
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, Table, CheckConstraint
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, Table, CheckConstraint, Index, select, func
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship, validates
+from sqlalchemy.orm import relationship, validates, column_property
 from datetime import datetime
 import re
 
 Base = declarative_base()
 
+# Validation constants, built once at import time
+_EMAIL_RE = re.compile(r'^[^@]+@[^@]+\.[^@]+$')
+_VALID_ROLES = frozenset({'student', 'teacher', 'admin'})
+_VALID_ROLES_SQL = ", ".join(f"'{role}'" for role in sorted(_VALID_ROLES))
+
+
+def normalize_email(address):
+    """Validate an email address and return it lowercased"""
+    if not _EMAIL_RE.match(address):
+        raise ValueError('Invalid email format')
+    return address.lower()
+
+
 # Association table for many-to-many relationship between activities and participants
 activity_participants = Table(
     'activity_participants',
@@ -19,6 +32,14 @@ activity_participants = Table(
     Column('enrolled_at', DateTime, default=datetime.utcnow, nullable=False)
 )
 
+# Reverse index for user -> activities lookups (the primary key covers activity -> users)
+Index(
+    'ix_participants_user_activity',
+    activity_participants.c.user_id,
+    activity_participants.c.activity_id,
+    postgresql_include=['enrolled_at']
+)
+
 
 class User(Base):
     """User model for students and staff"""
@@ -34,7 +55,7 @@ class User(Base):
     
     # Add constraints
     __table_args__ = (
-        CheckConstraint("role IN ('student', 'teacher', 'admin')", name='valid_role'),
+        CheckConstraint(f"role IN ({_VALID_ROLES_SQL})", name='valid_role'),
         CheckConstraint("email LIKE '%@%'", name='valid_email_format'),
     )
     
@@ -44,16 +65,13 @@ class User(Base):
     @validates('email')
     def validate_email(self, key, address):
         """Validate email format"""
-        if not re.match(r'^[^@]+@[^@]+\.[^@]+$', address):
-            raise ValueError('Invalid email format')
-        return address.lower()
+        return normalize_email(address)
     
     @validates('role')
     def validate_role(self, key, role):
         """Validate user role"""
-        valid_roles = {'student', 'teacher', 'admin'}
-        if role not in valid_roles:
-            raise ValueError(f'Role must be one of: {valid_roles}')
+        if role not in _VALID_ROLES:
+            raise ValueError(f'Role must be one of: {set(_VALID_ROLES)}')
         return role
 
 
@@ -76,10 +94,22 @@ class Activity(Base):
         CheckConstraint("length(description) >= 10", name='min_description_length'),
     )
     
-    # Relationship to users through association table
-    participants = relationship("User", secondary=activity_participants, back_populates="activities")
+    # Relationship to users through association table; lazy loads raise so
+    # endpoints must query enrollments explicitly (or eager-load them)
+    participants = relationship("User", secondary=activity_participants, back_populates="activities", lazy="raise_on_sql")
     creator = relationship("User", foreign_keys=[created_by])
     
+    # Participant count computed by the database as a correlated subquery;
+    # deferred, so select it explicitly or load it with undefer()
+    participant_count = column_property(
+        select(func.count())
+        .select_from(activity_participants)
+        .where(activity_participants.c.activity_id == id)
+        .correlate_except(activity_participants)
+        .scalar_subquery(),
+        deferred=True
+    )
+    
     @validates('max_participants')
     def validate_max_participants(self, key, value):
         """Validate maximum participants is positive"""
@@ -96,12 +126,14 @@ class Activity(Base):
     
     @property
     def available_spots(self):
-        """Calculate available spots in the activity"""
+        """Calculate available spots in the activity (legacy, loads all participants)"""
         return self.max_participants - len(self.participants)
     
     @property
     def is_full(self):
-        """Check if activity is full"""
+        """Check if activity is full (legacy, loads all participants)"""
         return len(self.participants) >= self.max_participants
-    participants = relationship("User", secondary=activity_participants, back_populates="activities")
-    creator = relationship("User", foreign_keys=[created_by])
+
+
+# Configure mappers at import time rather than on the first query
+Base.registry.configure()
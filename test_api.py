@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the signup/unregister API rules, including under
+concurrent requests. Runs against a throwaway SQLite database.
+"""
+
+import asyncio
+import sys
+import os
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Never touch the real database: point the app at a temporary file
+_tmp_dir = tempfile.TemporaryDirectory()
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{_tmp_dir.name}/test_api.db"
+
+import httpx
+from src.app import app
+from src.database import init_database, seed_initial_data
+
+
+async def signup(client, activity, email):
+    return await client.post(f"/activities/{activity}/signup", params={"email": email})
+
+
+async def participants(client, activity):
+    response = await client.get("/activities")
+    return response.json()[activity]["participants"]
+
+
+async def test_email_normalization(client):
+    """Emails are validated and lowercased at the API boundary"""
+    response = await signup(client, "Chess Club", "not-an-email")
+    assert response.status_code == 400, response.text
+    assert response.json()["detail"] == "Invalid email format"
+
+    response = await signup(client, "Chess Club", "Zed@Mergington.EDU")
+    assert response.status_code == 200, response.text
+    assert "zed@mergington.edu" in await participants(client, "Chess Club")
+
+    # Mixed case maps to the same user
+    response = await signup(client, "Chess Club", "zed@mergington.edu")
+    assert response.status_code == 400, response.text
+
+    # Separator characters inside an email must not split it
+    response = await signup(client, "Chess Club", "a,b@x.com")
+    assert response.status_code == 200, response.text
+    assert "a,b@x.com" in await participants(client, "Chess Club")
+    response = await client.delete(
+        "/activities/Chess Club/unregister", params={"email": "a,b@x.com"}
+    )
+    assert response.status_code == 200, response.text
+    print("✅ Email validation and normalization")
+
+
+async def test_duplicate_signups(client):
+    """Concurrent signups of the same student enroll them exactly once"""
+    responses = await asyncio.gather(
+        *[signup(client, "Art Club", "dup@mergington.edu") for _ in range(10)]
+    )
+    statuses = sorted(response.status_code for response in responses)
+    assert statuses == [200] + [400] * 9, statuses
+    assert all(
+        response.json()["detail"] == "Student is already signed up"
+        for response in responses if response.status_code == 400
+    )
+    assert (await participants(client, "Art Club")).count("dup@mergington.edu") == 1
+    print("✅ Duplicate signups rejected")
+
+
+async def test_capacity(client):
+    """Concurrent signups never exceed max_participants"""
+    response = await client.get("/activities")
+    gym = response.json()["Gym Class"]
+    free_spots = gym["available_spots"]
+
+    responses = await asyncio.gather(
+        *[signup(client, "Gym Class", f"gym{i}@mergington.edu") for i in range(free_spots + 10)]
+    )
+    succeeded = [response for response in responses if response.status_code == 200]
+    rejected = [response for response in responses if response.status_code != 200]
+    assert len(succeeded) == free_spots, len(succeeded)
+    assert all(response.json()["detail"] == "Activity is full" for response in rejected)
+
+    response = await client.get("/activities")
+    gym = response.json()["Gym Class"]
+    assert len(gym["participants"]) == gym["max_participants"]
+    assert gym["is_full"] and gym["available_spots"] == 0
+    print("✅ Capacity enforced under concurrency")
+
+
+async def test_api():
+    """Test API signup rules"""
+    print("🧪 Testing API signup rules...")
+
+    try:
+        await init_database()
+        await seed_initial_data()
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            await test_email_normalization(client)
+            await test_duplicate_signups(client)
+            await test_capacity(client)
+
+        print("🎉 API test passed!")
+        return True
+
+    except Exception as e:
+        print(f"❌ API test failed: {e!r}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+if __name__ == "__main__":
+    success = asyncio.run(test_api())
+    sys.exit(0 if success else 1)
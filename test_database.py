@@ -11,6 +11,7 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from src.database import init_database, seed_initial_data, AsyncSessionLocal
 from src.models import Activity, User
 from sqlalchemy import select
+from sqlalchemy.orm import selectinload
 
 
 async def test_database():
@@ -29,7 +30,6 @@ async def test_database():
         # Test querying activities
         async with AsyncSessionLocal() as session:
             # Use eager loading to avoid lazy loading issues
-            from sqlalchemy.orm import selectinload
             result = await session.execute(
                 select(Activity).options(selectinload(Activity.participants))
             )
@@ -54,7 +54,6 @@ async def test_database():
             await session.flush()
             
             # Get an activity with space (use eager loading)
-            from sqlalchemy.orm import selectinload
             result = await session.execute(
                 select(Activity)
                 .options(selectinload(Activity.participants))